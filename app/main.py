@@ -6,6 +6,7 @@ from fastapi.routing import APIRoute
 from fastapi.responses import JSONResponse
 from starlette.responses import RedirectResponse
 from .routers.financial import router as financial_router
+from .services.quickbooks import QBError, close_session, flush_pending_writes
 from fastapi.responses import JSONResponse, PlainTextResponse
 
 
@@ -28,6 +29,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.exception_handler(QBError)
+async def quickbooks_error_handler(request: Request, exc: QBError):
+    """Return QuickBooks service errors with their own HTTP status"""
+    return JSONResponse(status_code=exc.status_code, content={"detail": str(exc)})
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Finish pending token writes and close the shared QuickBooks HTTP session"""
+    await flush_pending_writes()
+    await close_session()
+
+
 # Print financial router routes for debugging
 print(
     "Financial router routes:",
@@ -8,7 +8,8 @@ class QuickBooksTokens(Base):
     __tablename__ = "quickbooks_tokens"
 
     id = Column(Integer, primary_key=True)
-    realm_id = Column(String, nullable=False)  # Changed from realm to realm_id
+    # Changed from realm to realm_id
+    realm_id = Column(String, nullable=False, unique=True, index=True)
     access_token = Column(String, nullable=False)
     refresh_token = Column(String, nullable=False)
     expires_at = Column(DateTime, nullable=False)
@@ -1,29 +1,25 @@
 # app/routers/financial.py
+import asyncio
 from fastapi import APIRouter, HTTPException, Depends
-from ..services.quickbooks import QuickBooksService
+from ..services.quickbooks import (
+    QBO_PROD_BASE,
+    QBAuthError,
+    QBError,
+    QuickBooksService,
+    disconnect_realm,
+    get_session,
+    month_to_date,
+)
 from fastapi.requests import Request
-from fastapi.responses import RedirectResponse, JSONResponse
-from fastapi.params import Query
+from fastapi.responses import RedirectResponse, JSONResponse, StreamingResponse
+from fastapi.params import Path, Query
 from ..database import get_db
 from sqlalchemy.orm import Session
-from typing import Optional
+from typing import Dict, Any, Optional
 import logging
-import aiohttp
-from ..database import get_db
 from ..models import QuickBooksTokens
-from ..services.quickbooks import QuickBooksService
-from typing import Dict, Any
 from ..agents.financial_agent.agent import FinancialAnalysisAgent
-import json
-import os
-import logging
-import traceback
-import aiohttp
-from datetime import datetime
-
-
-logger = logging.getLogger(__name__)
-
+import orjson
 
 logger = logging.getLogger(__name__)
 
@@ -41,6 +37,8 @@ async def get_auth_url(qb_service: QuickBooksService = Depends(get_quickbooks_se
     try:
         # Just return the result directly
         return await qb_service.get_auth_url()
+    except QBError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -62,6 +60,8 @@ async def get_accounts(qb_service: QuickBooksService = Depends(get_quickbooks_se
     try:
         accounts = await qb_service.get_accounts()
         return accounts
+    except QBError:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error fetching accounts: {str(e)}"
@@ -81,11 +81,12 @@ async def get_profit_loss(
             realm_id=realm_id,
             report_type="ProfitAndLoss",
             params={
-                "start_date": start_date
-                or datetime.now().replace(day=1).strftime("%Y-%m-%d"),
-                "end_date": end_date or datetime.now().strftime("%Y-%m-%d"),
+                "start_date": start_date or month_to_date()[0],
+                "end_date": end_date or month_to_date()[1],
             },
         )
+    except QBError:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error fetching profit/loss: {str(e)}"
@@ -140,14 +141,90 @@ async def get_balance_sheet(
 
         return result
 
+    except QBError:
+        raise
     except Exception as e:
-        logger.error(f"Balance sheet error: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception("Balance sheet error: %s", e)
         raise HTTPException(
             status_code=500, detail=f"Error fetching balance sheet: {str(e)}"
         )
 
 
+@router.get("/statements/snapshot")
+async def get_financial_snapshot(
+    realm_id: str = Query(...),
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    as_of_date: Optional[str] = Query(
+        None, description="Balance sheet date (YYYY-MM-DD), defaults to the period"
+    ),
+    qb_service: QuickBooksService = Depends(get_quickbooks_service),
+):
+    """Get the P&L, balance sheet and cash flow for one period in a single call"""
+    try:
+        return await qb_service.get_financial_snapshot(
+            start_date=start_date,
+            end_date=end_date,
+            as_of_date=as_of_date,
+            realm_id=realm_id,
+        )
+    except QBError:
+        raise
+    except Exception as e:
+        logger.exception("Financial snapshot error: %s", e)
+        raise HTTPException(
+            status_code=500, detail=f"Error fetching financial statements: {str(e)}"
+        )
+
+
+# Report types that may be proxied as raw JSON
+RAW_REPORT_TYPES = {
+    "ProfitAndLoss",
+    "BalanceSheet",
+    "CashFlow",
+    "StatementOfCashFlows",
+}
+
+
+@router.get("/reports/{report_type}/raw")
+async def stream_raw_report(
+    report_type: str,
+    realm_id: str = Query(...),
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    qb_service: QuickBooksService = Depends(get_quickbooks_service),
+):
+    """Stream a QuickBooks report's JSON through unparsed"""
+    if report_type not in RAW_REPORT_TYPES:
+        raise HTTPException(
+            status_code=404, detail=f"Unknown report type: {report_type}"
+        )
+
+    stream = qb_service.stream_report(
+        realm_id, report_type, {"start_date": start_date, "end_date": end_date}
+    )
+
+    # Pull the first chunk up front so upstream errors still map to a status code
+    try:
+        first_chunk = await stream.__anext__()
+    except StopAsyncIteration:
+        first_chunk = b""
+    except QBError:
+        raise
+    except Exception as e:
+        logger.exception("Raw %s report error: %s", report_type, e)
+        raise HTTPException(
+            status_code=500, detail=f"Error fetching {report_type}: {str(e)}"
+        )
+
+    async def body():
+        yield first_chunk
+        async for chunk in stream:
+            yield chunk
+
+    return StreamingResponse(body(), media_type="application/json")
+
+
 @router.get("/callback/quickbooks")
 async def quickbooks_callback(
     code: str = Query(None),
@@ -189,19 +266,6 @@ async def quickbooks_callback(
         )
 
 
-@router.get("/company-name/{realm_id}")
-async def get_company_name(
-    realm_id: str, qb_service: QuickBooksService = Depends(get_quickbooks_service)
-):
-    """Get the company name for a QuickBooks connection"""
-    try:
-        # In a real implementation, you would query QuickBooks for the company info
-        # For now, return a placeholder
-        return {"company_name": "Your Company Name"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-
 @router.get("/accounts/{realm_id}")
 async def get_accounts_by_realm(
     realm_id: str, qb_service: QuickBooksService = Depends(get_quickbooks_service)
@@ -210,6 +274,8 @@ async def get_accounts_by_realm(
     try:
         accounts = await qb_service.get_accounts_by_realm(realm_id)
         return accounts
+    except QBError:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error fetching accounts: {str(e)}"
@@ -239,6 +305,8 @@ async def get_financial_trends(
         raise HTTPException(
             status_code=500, detail=f"Error in financial trends service: {str(e)}"
         )
+    except QBError:
+        raise
     except Exception as e:
         # Handle other exceptions
         logger.error(f"Error analyzing financial trends: {str(e)}")
@@ -248,51 +316,68 @@ async def get_financial_trends(
 
 
 @router.get("/financial/accounts/{realm_id}", response_model=dict)
-async def get_quickbooks_accounts(realm_id: str, db: Session = Depends(get_db)):
+async def get_quickbooks_accounts(
+    realm_id: str, qb_service: QuickBooksService = Depends(get_quickbooks_service)
+):
     """
     Retrieve all accounts for a given QuickBooks realm ID.
     """
     try:
-        quickbooks_service = QuickBooksService(db)
-        accounts = await quickbooks_service.get_accounts_by_realm(realm_id)
+        accounts = await qb_service.get_accounts_by_realm(realm_id)
         return accounts
+    except QBError:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error fetching accounts: {str(e)}"
         )
 
 
-@router.post("/disconnect/{realm_id}")
-async def disconnect_quickbooks(
-    realm_id: str,
-    qb_service: QuickBooksService = Depends(get_quickbooks_service),
-    db: Session = Depends(get_db),
-):
-    """Disconnect from a QuickBooks company"""
+def _delete_tokens(db: Session, realm_id: str) -> bool:
+    """Delete a realm's stored tokens, returning whether there were any"""
     try:
-        # Delete the tokens for this realm
         token_record = (
             db.query(QuickBooksTokens)
             .filter(QuickBooksTokens.realm_id == realm_id)
             .first()
         )
+        if not token_record:
+            return False
 
-        if token_record:
-            db.delete(token_record)
-            db.commit()
-            return {
-                "success": True,
-                "message": f"Disconnected from company with realm_id {realm_id}",
-            }
-        else:
-            return {"success": False, "message": "No connection found for this company"}
-    except Exception as e:
+        db.delete(token_record)
+        db.commit()
+        return True
+    except Exception:
         db.rollback()
+        raise
+
+
+@router.post("/disconnect/{realm_id}")
+async def disconnect_quickbooks(
+    realm_id: str = Path(..., pattern=r"^\d+$"),
+    qb_service: QuickBooksService = Depends(get_quickbooks_service),
+    db: Session = Depends(get_db),
+):
+    """Disconnect from a QuickBooks company"""
+    try:
+        # The session is synchronous, so only the delete runs in a worker thread
+        deleted = await asyncio.to_thread(_delete_tokens, db, realm_id)
+    except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error disconnecting: {str(e)}")
 
+    if not deleted:
+        return {"success": False, "message": "No connection found for this company"}
+
+    # The caches are shared with the event loop, so they're cleared from it
+    await disconnect_realm(realm_id)
+    return {
+        "success": True,
+        "message": f"Disconnected from company with realm_id {realm_id}",
+    }
+
 
 @router.get("/trends/{realm_id}")
-async def get_financial_trends(
+async def get_monthly_trends(
     realm_id: str,
     months: int = Query(6, ge=1, le=12),
     qb_service: QuickBooksService = Depends(get_quickbooks_service),
@@ -311,6 +396,8 @@ async def get_financial_trends(
         )
 
         return trend_data
+    except QBError:
+        raise
     except Exception as e:
         logger.error(f"Error analyzing financial trends: {str(e)}")
         raise HTTPException(
@@ -468,16 +555,16 @@ async def get_cash_flow(
             realm_id=realm_id,
             report_type="StatementOfCashFlows",  # Changed from "CashFlow"
             params={
-                "start_date": start_date
-                or datetime.now().replace(day=1).strftime("%Y-%m-%d"),
-                "end_date": end_date or datetime.now().strftime("%Y-%m-%d"),
+                "start_date": start_date or month_to_date()[0],
+                "end_date": end_date or month_to_date()[1],
                 "minorversion": "75",
             },
         )
+    except QBAuthError:
+        # A renamed report won't fix a missing or revoked connection
+        raise
     except Exception as e:
-        logger.error(
-            f"Error fetching cash flow: {str(e)}, traceback: {traceback.format_exc()}"
-        )
+        logger.exception("Error fetching cash flow: %s", e)
 
         # If the first attempt fails, try with the original "CashFlow" name
         try:
@@ -485,12 +572,13 @@ async def get_cash_flow(
                 realm_id=realm_id,
                 report_type="CashFlow",
                 params={
-                    "start_date": start_date
-                    or datetime.now().replace(day=1).strftime("%Y-%m-%d"),
-                    "end_date": end_date or datetime.now().strftime("%Y-%m-%d"),
+                    "start_date": start_date or month_to_date()[0],
+                    "end_date": end_date or month_to_date()[1],
                     "minorversion": "75",
                 },
             )
+        except QBError:
+            raise
         except Exception as inner_e:
             logger.error(f"Error with fallback CashFlow: {str(inner_e)}")
             raise HTTPException(
@@ -500,7 +588,7 @@ async def get_cash_flow(
 
 
 @router.get("/connection-status")
-async def check_current_connection(db: Session = Depends(get_db)):
+def check_current_connection(db: Session = Depends(get_db)):
     """Check if any active QuickBooks connection exists"""
     try:
         # Get the most recent active token from the database
@@ -526,28 +614,28 @@ async def get_company_name(
         auth_token = await qb_service._get_access_token(realm_id)
 
         # Set API URL
-        url = f"https://quickbooks.api.intuit.com/v3/company/{realm_id}/companyinfo/{realm_id}"
+        url = f"{QBO_PROD_BASE}/v3/company/{realm_id}/companyinfo/{realm_id}"
 
         # API request
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                url,
-                headers={
-                    "Authorization": f"Bearer {auth_token}",
-                    "Accept": "application/json",
-                },
-            ) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return {
-                        "company_name": data.get("CompanyInfo", {}).get(
-                            "CompanyName", "Name Not Found"
-                        )
-                    }
-                else:
-                    return {
-                        "company_name": f"API Error: {response.status}",
-                        "error": await response.text(),
-                    }
+        session = await get_session()
+        async with session.get(
+            url,
+            headers={
+                "Authorization": f"Bearer {auth_token}",
+                "Accept": "application/json",
+            },
+        ) as response:
+            if response.status == 200:
+                data = orjson.loads(await response.read())
+                return {
+                    "company_name": data.get("CompanyInfo", {}).get(
+                        "CompanyName", "Name Not Found"
+                    )
+                }
+            else:
+                return {
+                    "company_name": f"API Error: {response.status}",
+                    "error": await response.text(),
+                }
     except Exception as e:
         return {"company_name": f"Exception: {type(e).__name__}", "error": str(e)}
@@ -1,23 +1,361 @@
 # app/services/financial_statements.py
-from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional
+from bisect import bisect_left, bisect_right
+import calendar
+from dataclasses import dataclass, field
+from datetime import datetime
+from types import MappingProxyType
+from typing import Dict, List, Any, NamedTuple, Optional, Sequence
+import asyncio
 import logging
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
 
-from ..services.quickbooks import QuickbooksService
+from ..services.quickbooks import QuickBooksService
 from ..models import FinancialAnalysis
-import traceback
 
 logger = logging.getLogger(__name__)
 
+# Summary bands: below -10, below 0, unchanged, above 0, above 10
+_TREND_LOWER_THRESHOLDS = (-10, 0)
+_TREND_UPPER_THRESHOLDS = (0, 10)
+
+# Current ratio bands: below 1, at least 1, at least 2
+_LIQUIDITY_THRESHOLDS = (1, 2)
+
+_REVENUE_SUMMARY = (
+    "Revenue has declined significantly.",
+    "Revenue has slightly decreased.",
+    "Revenue has remained stable.",
+    "Revenue is showing moderate growth.",
+    "Revenue is growing strongly.",
+)
+_PROFITABILITY_SUMMARY = (
+    "Profitability has declined significantly.",
+    "Profitability has slightly decreased.",
+    "Profitability has remained stable.",
+    "Profitability has slightly improved.",
+    "Profitability has improved significantly.",
+)
+_LIQUIDITY_SUMMARY = (
+    "Liquidity position needs attention.",
+    "Liquidity position is adequate.",
+    "Liquidity position is strong.",
+)
+_OPERATING_CASH_SUMMARY = (
+    "Operating cash flow has declined significantly.",
+    "Operating cash flow has slightly decreased.",
+    "Operating cash flow has remained stable.",
+    "Operating cash flow has slightly improved.",
+    "Operating cash flow has improved significantly.",
+)
+
+# QBO P&L row groups and the account type recorded for their detail lines
+_PL_GROUP_ACCOUNT_TYPES = MappingProxyType(
+    {
+        "Income": "Income",
+        "COGS": "Cost of Goods Sold",
+        "Expenses": "Expense",
+        "OtherIncome": "Other Income",
+        "OtherExpenses": "Other Expense",
+    }
+)
+
+
+def _trend_band(change: float) -> int:
+    """Map a percentage change to its index in a five-band summary table"""
+    # Negative bounds are exclusive (< -10, < 0), positive bounds strict (> 0, > 10)
+    return bisect_right(_TREND_LOWER_THRESHOLDS, change) + bisect_left(
+        _TREND_UPPER_THRESHOLDS, change
+    )
+
+
+def _pct_change_batch(
+    current: Sequence[float], previous: Sequence[float]
+) -> List[float]:
+    """Calculate percentage changes for paired metric values in a single pass"""
+    return [
+        0.0 if prev == 0 else ((curr - prev) / abs(prev)) * 100
+        for curr, prev in zip(current, previous)
+    ]
+
+
+def _metric_value(statement: Any, key: str) -> float:
+    """Extract numerical value from a formatted statement safely"""
+    try:
+        value = getattr(statement, key, 0)
+        return float(value) if value is not None else 0.0
+    except (ValueError, TypeError):
+        return 0.0
+
+
+class _StatementMetrics:
+    __slots__ = ()
+
+    @classmethod
+    def from_statement(cls, statement: Any):
+        """Extract every metric field from a formatted statement in one pass"""
+        return cls(*(_metric_value(statement, name) for name in cls.__match_args__))
+
+    def is_empty(self) -> bool:
+        """True when every metric is zero (e.g. a period with no activity)"""
+        return not any(getattr(self, name) for name in self.__match_args__)
+
+
+@dataclass(slots=True, frozen=True)
+class PLMetrics(_StatementMetrics):
+    """Key figures from a formatted Profit & Loss statement"""
+
+    total_income: float
+    total_cogs: float
+    gross_profit: float
+    total_expenses: float
+    net_income: float
+
+
+@dataclass(slots=True, frozen=True)
+class BSMetrics(_StatementMetrics):
+    """Key figures from a formatted Balance Sheet"""
+
+    total_assets: float
+    current_assets: float
+    total_liabilities: float
+    current_liabilities: float
+    total_equity: float
+
+
+@dataclass(slots=True, frozen=True)
+class CFMetrics(_StatementMetrics):
+    """Key figures from a formatted Statement of Cash Flows"""
+
+    total_operating_cash_flow: float
+    total_investing_cash_flow: float
+    total_financing_cash_flow: float
+    net_cash_change: float
+
+
+@dataclass(slots=True)
+class ProfitAndLossStatement:
+    """Formatted Profit & Loss statement"""
+
+    company_name: str
+    period: Dict[str, str]
+    income: List[Dict[str, Any]] = field(default_factory=list)
+    total_income: float = 0
+    cost_of_goods_sold: List[Dict[str, Any]] = field(default_factory=list)
+    total_cogs: float = 0
+    gross_profit: float = 0
+    expenses: List[Dict[str, Any]] = field(default_factory=list)
+    total_expenses: float = 0
+    operating_income: float = 0
+    other_income: List[Dict[str, Any]] = field(default_factory=list)
+    total_other_income: float = 0
+    other_expenses: List[Dict[str, Any]] = field(default_factory=list)
+    total_other_expenses: float = 0
+    net_income: float = 0
+    statement_type: str = "Profit and Loss"
+
+
+@dataclass(slots=True)
+class BalanceSheetStatement:
+    """Formatted Balance Sheet"""
+
+    company_name: str
+    as_of_date: str
+    assets: List[Dict[str, Any]] = field(default_factory=list)
+    total_assets: float = 0
+    liabilities: List[Dict[str, Any]] = field(default_factory=list)
+    total_liabilities: float = 0
+    equity: List[Dict[str, Any]] = field(default_factory=list)
+    total_equity: float = 0
+    liabilities_and_equity: float = 0
+    statement_type: str = "Balance Sheet"
+
+
+@dataclass(slots=True)
+class CashFlowStatement:
+    """Formatted Statement of Cash Flows"""
+
+    company_name: str
+    period: Dict[str, str]
+    operating_activities: Dict[str, Any] = field(
+        default_factory=lambda: {"net_income": 0, "adjustments": []}
+    )
+    total_operating_cash_flow: float = 0
+    investing_activities: List[Dict[str, Any]] = field(default_factory=list)
+    total_investing_cash_flow: float = 0
+    financing_activities: List[Dict[str, Any]] = field(default_factory=list)
+    total_financing_cash_flow: float = 0
+    net_cash_change: float = 0
+    beginning_cash_balance: float = 0
+    ending_cash_balance: float = 0
+    statement_type: str = "Statement of Cash Flows"
+
+
+# Trend results for two periods with no activity at all
+_EMPTY_PL_TRENDS = MappingProxyType(
+    {
+        "revenue_change": 0.0,
+        "cogs_change": 0.0,
+        "gross_profit_change": 0.0,
+        "expenses_change": 0.0,
+        "net_income_change": 0.0,
+        "gross_margin": 0,
+        "net_margin": 0,
+        "gross_margin_change": 0,
+        "net_margin_change": 0,
+    }
+)
+_EMPTY_BS_TRENDS = MappingProxyType(
+    {
+        "total_assets_change": 0.0,
+        "total_liabilities_change": 0.0,
+        "equity_change": 0.0,
+        "current_ratio": 0.0,
+        "debt_to_equity": 0.0,
+        "current_ratio_change": 0.0,
+        "debt_to_equity_change": 0.0,
+    }
+)
+_EMPTY_CF_TRENDS = MappingProxyType(
+    {
+        "operating_cash_change": 0.0,
+        "investing_cash_change": 0.0,
+        "financing_cash_change": 0.0,
+        "net_cash_change": 0.0,
+    }
+)
+
+
+# Narrative rules, evaluated in order: (bucket, condition, message, key).
+# When key is set, the message is a template filled with that value's magnitude.
+_NARRATIVE_RULES = (
+    # Positive trends
+    (
+        "positive",
+        lambda v: v["revenue_change"] > 0,
+        "Revenue increased by {:.1f}%",
+        "revenue_change",
+    ),
+    (
+        "positive",
+        lambda v: v["net_income_change"] > 0,
+        "Net income improved by {:.1f}%",
+        "net_income_change",
+    ),
+    (
+        "positive",
+        lambda v: v["gross_margin_change"] > 0,
+        "Gross margin improved by {:.1f} percentage points",
+        "gross_margin_change",
+    ),
+    (
+        "positive",
+        lambda v: v["current_ratio"] > 1.5,
+        "Strong short-term liquidity position",
+        None,
+    ),
+    (
+        "positive",
+        lambda v: v["operating_cash_change"] > 0,
+        "Improving operating cash flow",
+        None,
+    ),
+    # Areas of concern
+    (
+        "concern",
+        lambda v: v["revenue_change"] < 0,
+        "Revenue decreased by {:.1f}%",
+        "revenue_change",
+    ),
+    (
+        "concern",
+        lambda v: v["net_income_change"] < 0,
+        "Net income decreased by {:.1f}%",
+        "net_income_change",
+    ),
+    (
+        "concern",
+        lambda v: v["expenses_change"] > v["revenue_change"],
+        "Expenses growing faster than revenue",
+        None,
+    ),
+    (
+        "concern",
+        lambda v: v["current_ratio"] < 1,
+        "Current ratio below 1.0 indicates potential liquidity issues",
+        None,
+    ),
+    (
+        "concern",
+        lambda v: v["debt_to_equity"] > 2,
+        "High debt-to-equity ratio may indicate excessive leverage",
+        None,
+    ),
+    (
+        "concern",
+        lambda v: v["operating_cash_change"] < 0,
+        "Declining operating cash flow",
+        None,
+    ),
+    # Recommendations
+    (
+        "recommendation",
+        lambda v: v["revenue_change"] < 0,
+        "Focus on sales growth initiatives",
+        None,
+    ),
+    (
+        "recommendation",
+        lambda v: v["expenses_change"] > v["revenue_change"],
+        "Implement cost control measures",
+        None,
+    ),
+    (
+        "recommendation",
+        lambda v: v["gross_margin_change"] < 0,
+        "Review pricing strategy and cost of goods sold",
+        None,
+    ),
+    (
+        "recommendation",
+        lambda v: v["current_ratio"] < 1,
+        "Improve working capital management",
+        None,
+    ),
+    (
+        "recommendation",
+        lambda v: v["debt_to_equity"] > 2,
+        "Consider debt reduction strategies",
+        None,
+    ),
+    (
+        "recommendation",
+        lambda v: v["operating_cash_change"] < 0,
+        "Focus on improving cash conversion cycle",
+        None,
+    ),
+)
+
+
+class Narrative(NamedTuple):
+    """Text fields of a stored financial analysis"""
+
+    summary: str
+    positive_insights: str
+    concerns: str
+    recommendations: str
+
 
 class FinancialStatementsService:
-    def __init__(self, quickbooks_service: QuickbooksService):
+    # Cash flow report name that QBO accepted, remembered after the first success
+    _cf_report_name: Optional[str] = None
+
+    def __init__(self, quickbooks_service: QuickBooksService):
         self.qb_service = quickbooks_service
 
     async def get_profit_and_loss(
         self, realm_id: str, start_date: str, end_date: str
-    ) -> Dict[str, Any]:
+    ) -> ProfitAndLossStatement:
         """
         Generate a Profit and Loss statement for the specified period using QBO Report API.
 
@@ -27,7 +365,7 @@ class FinancialStatementsService:
             end_date: End date in format YYYY-MM-DD
 
         Returns:
-            Dict containing the formatted P&L statement
+            The formatted P&L statement
         """
         try:
             # Call the QBO ProfitAndLoss report endpoint
@@ -49,10 +387,12 @@ class FinancialStatementsService:
             return formatted_data
 
         except Exception as e:
-            logger.error(f"Error generating Profit & Loss statement: {str(e)}")
+            logger.error("Error generating Profit & Loss statement: %s", e)
             raise
 
-    async def get_balance_sheet(self, realm_id: str, as_of_date: str) -> Dict[str, Any]:
+    async def get_balance_sheet(
+        self, realm_id: str, as_of_date: str
+    ) -> BalanceSheetStatement:
         """
         Generate a Balance Sheet as of the specified date using QBO Report API.
 
@@ -61,12 +401,14 @@ class FinancialStatementsService:
             as_of_date: Date for the balance sheet in format YYYY-MM-DD
 
         Returns:
-            Dict containing the formatted Balance Sheet
+            The formatted Balance Sheet
         """
         try:
             # Log the parameters
             logger.debug(
-                f"Getting balance sheet for realm_id={realm_id}, as_of_date={as_of_date}"
+                "Getting balance sheet for realm_id=%s, as_of_date=%s",
+                realm_id,
+                as_of_date,
             )
 
             # Call the QBO BalanceSheet report endpoint
@@ -84,13 +426,12 @@ class FinancialStatementsService:
             return formatted_data
 
         except Exception as e:
-            logger.error(f"Error generating Balance Sheet: {str(e)}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
+            logger.exception("Error generating Balance Sheet: %s", e)
             raise
 
     async def get_cash_flow_statement(
         self, realm_id: str, start_date: str, end_date: str
-    ) -> Dict[str, Any]:
+    ) -> CashFlowStatement:
         """
         Generate a Statement of Cash Flows for the specified period using QBO Report API.
 
@@ -100,52 +441,58 @@ class FinancialStatementsService:
             end_date: End date in format YYYY-MM-DD
 
         Returns:
-            Dict containing the formatted Statement of Cash Flows
+            The formatted Statement of Cash Flows
         """
         try:
             # Log the parameters
             logger.debug(
-                f"Getting cash flow for realm_id={realm_id}, start_date={start_date}, end_date={end_date}"
+                "Getting cash flow for realm_id=%s, start_date=%s, end_date=%s",
+                realm_id,
+                start_date,
+                end_date,
             )
 
-            # Try with "StatementOfCashFlows" first
-            try:
-                report_data = await self.qb_service.get_report(
-                    realm_id=realm_id,
-                    report_type="StatementOfCashFlows",
-                    params={
-                        "start_date": start_date,
-                        "end_date": end_date,
-                        "minorversion": "75",
-                    },
-                )
-            except Exception as e1:
-                logger.warning(
-                    f"Error with StatementOfCashFlows, trying CashFlow: {str(e1)}"
-                )
-                # Fall back to "CashFlow" if the first attempt fails
+            params = {
+                "start_date": start_date,
+                "end_date": end_date,
+                "minorversion": "75",
+            }
+
+            report_name = FinancialStatementsService._cf_report_name
+            if report_name:
+                # Skip the fallback round-trip once we know which name works
                 report_data = await self.qb_service.get_report(
-                    realm_id=realm_id,
-                    report_type="CashFlow",
-                    params={
-                        "start_date": start_date,
-                        "end_date": end_date,
-                        "minorversion": "75",
-                    },
+                    realm_id=realm_id, report_type=report_name, params=params
                 )
+            else:
+                # Try with "StatementOfCashFlows" first
+                try:
+                    report_name = "StatementOfCashFlows"
+                    report_data = await self.qb_service.get_report(
+                        realm_id=realm_id, report_type=report_name, params=params
+                    )
+                except Exception as e1:
+                    logger.warning(
+                        "Error with StatementOfCashFlows, trying CashFlow: %s", e1
+                    )
+                    # Fall back to "CashFlow" if the first attempt fails
+                    report_name = "CashFlow"
+                    report_data = await self.qb_service.get_report(
+                        realm_id=realm_id, report_type=report_name, params=params
+                    )
+                FinancialStatementsService._cf_report_name = report_name
 
             # Process the report response into our standardized format
             formatted_data = self._format_cash_flow(report_data, start_date, end_date)
             return formatted_data
 
         except Exception as e:
-            logger.error(f"Error generating Cash Flow Statement: {str(e)}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
+            logger.exception("Error generating Cash Flow Statement: %s", e)
             raise
 
     def _format_profit_and_loss(
         self, report_data: Dict[str, Any], start_date: str, end_date: str
-    ) -> Dict[str, Any]:
+    ) -> ProfitAndLossStatement:
         """
         Format the QuickBooks ProfitAndLoss report response into our standardized format.
 
@@ -162,42 +509,45 @@ class FinancialStatementsService:
         if not company_name:
             company_name = "Your Company"
 
-        # Initialize sections
-        income_items = []
-        cogs_items = []
-        expense_items = []
-        other_income_items = []
-        other_expense_items = []
+        # Initialize sections, keyed by the P&L group that feeds them
+        sections = {group: [] for group in _PL_GROUP_ACCOUNT_TYPES}
+        totals = dict.fromkeys(_PL_GROUP_ACCOUNT_TYPES, 0)
 
         # Process report rows
         # The actual structure will depend on QBO's response format
         rows = report_data.get("Rows", {}).get("Row", [])
 
-        # Track totals
-        total_income = 0
-        total_cogs = 0
-        total_expenses = 0
-        total_other_income = 0
-        total_other_expense = 0
-
         # Extract data from rows
         # This is a simplistic example - the actual QBO response will need careful parsing
         for row in rows:
-            if row.get("group") == "Income" and not row.get("Summary"):
-                for detail in row.get("Rows", {}).get("Row", []):
-                    if detail.get("type") == "Data":
-                        amount = float(detail.get("value", 0))
-                        income_items.append(
-                            {
-                                "id": detail.get("id", ""),
-                                "name": detail.get("ColData", [{}])[0].get("value", ""),
-                                "amount": amount,
-                                "account_type": "Income",
-                            }
-                        )
-                        total_income += amount
-
-            # Continue similar parsing for other sections...
+            group = row.get("group")
+            account_type = _PL_GROUP_ACCOUNT_TYPES.get(group)
+            if account_type is None or row.get("Summary"):
+                continue
+
+            items = sections[group]
+            total = 0
+            for detail in row.get("Rows", {}).get("Row", []):
+                detail_get = detail.get
+                if detail_get("type") != "Data":
+                    continue
+                amount = float(detail_get("value", 0))
+                items.append(
+                    {
+                        "id": detail_get("id", ""),
+                        "name": detail_get("ColData", [{}])[0].get("value", ""),
+                        "amount": amount,
+                        "account_type": account_type,
+                    }
+                )
+                total += amount
+            totals[group] += total
+
+        total_income = totals["Income"]
+        total_cogs = totals["COGS"]
+        total_expenses = totals["Expenses"]
+        total_other_income = totals["OtherIncome"]
+        total_other_expense = totals["OtherExpenses"]
 
         # Calculate key figures
         gross_profit = total_income - total_cogs
@@ -205,28 +555,27 @@ class FinancialStatementsService:
         net_income = operating_income + total_other_income - total_other_expense
 
         # Return formatted data
-        return {
-            "statement_type": "Profit and Loss",
-            "company_name": company_name,
-            "period": {"start_date": start_date, "end_date": end_date},
-            "income": income_items,
-            "total_income": total_income,
-            "cost_of_goods_sold": cogs_items,
-            "total_cogs": total_cogs,
-            "gross_profit": gross_profit,
-            "expenses": expense_items,
-            "total_expenses": total_expenses,
-            "operating_income": operating_income,
-            "other_income": other_income_items,
-            "total_other_income": total_other_income,
-            "other_expenses": other_expense_items,
-            "total_other_expenses": total_other_expense,
-            "net_income": net_income,
-        }
+        return ProfitAndLossStatement(
+            company_name=company_name,
+            period={"start_date": start_date, "end_date": end_date},
+            income=sections["Income"],
+            total_income=total_income,
+            cost_of_goods_sold=sections["COGS"],
+            total_cogs=total_cogs,
+            gross_profit=gross_profit,
+            expenses=sections["Expenses"],
+            total_expenses=total_expenses,
+            operating_income=operating_income,
+            other_income=sections["OtherIncome"],
+            total_other_income=total_other_income,
+            other_expenses=sections["OtherExpenses"],
+            total_other_expenses=total_other_expense,
+            net_income=net_income,
+        )
 
     def _format_balance_sheet(
         self, report_data: Dict[str, Any], as_of_date: str
-    ) -> Dict[str, Any]:
+    ) -> BalanceSheetStatement:
         """
         Format the QuickBooks BalanceSheet report response into our standardized format.
 
@@ -235,22 +584,11 @@ class FinancialStatementsService:
         """
         # Implementation details would go here based on actual QBO response format
         # For now, this is a placeholder
-        return {
-            "statement_type": "Balance Sheet",
-            "company_name": "Your Company",
-            "as_of_date": as_of_date,
-            "assets": [],
-            "total_assets": 0,
-            "liabilities": [],
-            "total_liabilities": 0,
-            "equity": [],
-            "total_equity": 0,
-            "liabilities_and_equity": 0,
-        }
+        return BalanceSheetStatement(company_name="Your Company", as_of_date=as_of_date)
 
     def _format_cash_flow(
         self, report_data: Dict[str, Any], start_date: str, end_date: str
-    ) -> Dict[str, Any]:
+    ) -> CashFlowStatement:
         """
         Format the QuickBooks CashFlow report response into our standardized format.
 
@@ -259,20 +597,10 @@ class FinancialStatementsService:
         """
         # Implementation details would go here based on actual QBO response format
         # For now, this is a placeholder
-        return {
-            "statement_type": "Statement of Cash Flows",
-            "company_name": "Your Company",
-            "period": {"start_date": start_date, "end_date": end_date},
-            "operating_activities": {"net_income": 0, "adjustments": []},
-            "total_operating_cash_flow": 0,
-            "investing_activities": [],
-            "total_investing_cash_flow": 0,
-            "financing_activities": [],
-            "total_financing_cash_flow": 0,
-            "net_cash_change": 0,
-            "beginning_cash_balance": 0,
-            "ending_cash_balance": 0,
-        }
+        return CashFlowStatement(
+            company_name="Your Company",
+            period={"start_date": start_date, "end_date": end_date},
+        )
 
     async def analyze_financial_trends(
         self, realm_id: str, db: Session
@@ -290,30 +618,37 @@ class FinancialStatementsService:
         try:
             # Get current date info for default periods
             today = datetime.now()
-            current_month_start = today.replace(day=1).strftime("%Y-%m-%d")
-            current_month_end = today.strftime("%Y-%m-%d")
+            year, month = today.year, today.month
+            current_month_start = f"{year:04d}-{month:02d}-01"
+            current_month_end = f"{year:04d}-{month:02d}-{today.day:02d}"
 
             # For previous period comparison - get previous month
-            prev_month = today.replace(day=1) - timedelta(days=1)
-            prev_month_start = prev_month.replace(day=1).strftime("%Y-%m-%d")
-            prev_month_end = prev_month.strftime("%Y-%m-%d")
-
-            # Get current financial statements
-            current_pl = await self.get_profit_and_loss(
-                realm_id, current_month_start, current_month_end
-            )
-            current_bs = await self.get_balance_sheet(realm_id, current_month_end)
-            current_cf = await self.get_cash_flow_statement(
-                realm_id, current_month_start, current_month_end
-            )
-
-            # Get previous period statements for comparison
-            prev_pl = await self.get_profit_and_loss(
-                realm_id, prev_month_start, prev_month_end
-            )
-            prev_bs = await self.get_balance_sheet(realm_id, prev_month_end)
-            prev_cf = await self.get_cash_flow_statement(
-                realm_id, prev_month_start, prev_month_end
+            prev_year, prev_month = (year, month - 1) if month > 1 else (year - 1, 12)
+            prev_last_day = calendar.monthrange(prev_year, prev_month)[1]
+            prev_month_start = f"{prev_year:04d}-{prev_month:02d}-01"
+            prev_month_end = f"{prev_year:04d}-{prev_month:02d}-{prev_last_day:02d}"
+
+            # Fetch current and previous period statements concurrently
+            (
+                current_pl,
+                current_bs,
+                current_cf,
+                prev_pl,
+                prev_bs,
+                prev_cf,
+            ) = await asyncio.gather(
+                self.get_profit_and_loss(
+                    realm_id, current_month_start, current_month_end
+                ),
+                self.get_balance_sheet(realm_id, current_month_end),
+                self.get_cash_flow_statement(
+                    realm_id, current_month_start, current_month_end
+                ),
+                self.get_profit_and_loss(realm_id, prev_month_start, prev_month_end),
+                self.get_balance_sheet(realm_id, prev_month_end),
+                self.get_cash_flow_statement(
+                    realm_id, prev_month_start, prev_month_end
+                ),
             )
 
             # Perform trend analysis
@@ -322,93 +657,92 @@ class FinancialStatementsService:
             cf_trends = self._analyze_cf_trends(current_cf, prev_cf)
 
             # Create financial analysis record
-            analysis = FinancialAnalysis(
-                realm_id=realm_id,
-                summary=self._generate_summary(pl_trends, bs_trends, cf_trends),
-                positive_insights=self._extract_positive_insights(
-                    pl_trends, bs_trends, cf_trends
-                ),
-                concerns=self._extract_concerns(pl_trends, bs_trends, cf_trends),
-                recommendations=self._generate_recommendations(
-                    pl_trends, bs_trends, cf_trends
-                ),
-                analysis_date=today,
-            )
+            narrative = self._build_narrative(pl_trends, bs_trends, cf_trends)
+            analysis = {
+                "realm_id": realm_id,
+                **narrative._asdict(),
+                "analysis_date": today,
+            }
 
-            # Save to database
-            db.add(analysis)
-            db.commit()
+            # Save to database without blocking the event loop
+            await asyncio.to_thread(self._save_analyses, db, [analysis])
 
             # Return consolidated trends
             return {
                 "profit_loss_trends": pl_trends,
                 "balance_sheet_trends": bs_trends,
                 "cash_flow_trends": cf_trends,
-                "summary": analysis.summary,
-                "positive_insights": analysis.positive_insights,
-                "concerns": analysis.concerns,
-                "recommendations": analysis.recommendations,
-                "analysis_date": analysis.analysis_date.isoformat(),
+                "summary": narrative.summary,
+                "positive_insights": narrative.positive_insights,
+                "concerns": narrative.concerns,
+                "recommendations": narrative.recommendations,
+                "analysis_date": today.isoformat(),
             }
 
         except Exception as e:
-            logger.error(f"Error analyzing financial trends: {str(e)}")
+            logger.error("Error analyzing financial trends: %s", e)
+            raise
+
+    def _save_analyses(self, db: Session, analyses: List[Dict[str, Any]]) -> None:
+        """Persist analysis rows with a single multi-row INSERT and commit"""
+        try:
+            db.execute(insert(FinancialAnalysis), analyses)
+            db.commit()
+        except Exception:
+            db.rollback()
             raise
 
     def _analyze_pl_trends(
-        self, current_pl: Dict[str, Any], prev_pl: Dict[str, Any]
+        self, current_pl: ProfitAndLossStatement, prev_pl: ProfitAndLossStatement
     ) -> Dict[str, Any]:
         """Analyze trends in Profit & Loss statements"""
         trends = {}
 
         try:
-            # Get key metrics from current P&L
-            current_total_income = self._extract_pl_value(current_pl, "total_income")
-            current_total_cogs = self._extract_pl_value(current_pl, "total_cogs")
-            current_gross_profit = self._extract_pl_value(current_pl, "gross_profit")
-            current_total_expenses = self._extract_pl_value(
-                current_pl, "total_expenses"
-            )
-            current_net_income = self._extract_pl_value(current_pl, "net_income")
-
-            # Get key metrics from previous P&L
-            prev_total_income = self._extract_pl_value(prev_pl, "total_income")
-            prev_total_cogs = self._extract_pl_value(prev_pl, "total_cogs")
-            prev_gross_profit = self._extract_pl_value(prev_pl, "gross_profit")
-            prev_total_expenses = self._extract_pl_value(prev_pl, "total_expenses")
-            prev_net_income = self._extract_pl_value(prev_pl, "net_income")
-
-            # Calculate changes (percentage)
-            trends["revenue_change"] = self._calculate_percentage_change(
-                current_total_income, prev_total_income
-            )
-            trends["cogs_change"] = self._calculate_percentage_change(
-                current_total_cogs, prev_total_cogs
-            )
-            trends["gross_profit_change"] = self._calculate_percentage_change(
-                current_gross_profit, prev_gross_profit
-            )
-            trends["expenses_change"] = self._calculate_percentage_change(
-                current_total_expenses, prev_total_expenses
-            )
-            trends["net_income_change"] = self._calculate_percentage_change(
-                current_net_income, prev_net_income
+            # Extract key metrics from both periods once
+            current = PLMetrics.from_statement(current_pl)
+            prev = PLMetrics.from_statement(prev_pl)
+            if current.is_empty() and prev.is_empty():
+                return dict(_EMPTY_PL_TRENDS)
+
+            # Calculate changes (percentage) for all metrics at once
+            (
+                trends["revenue_change"],
+                trends["cogs_change"],
+                trends["gross_profit_change"],
+                trends["expenses_change"],
+                trends["net_income_change"],
+            ) = _pct_change_batch(
+                (
+                    current.total_income,
+                    current.total_cogs,
+                    current.gross_profit,
+                    current.total_expenses,
+                    current.net_income,
+                ),
+                (
+                    prev.total_income,
+                    prev.total_cogs,
+                    prev.gross_profit,
+                    prev.total_expenses,
+                    prev.net_income,
+                ),
             )
 
             # Calculate current ratios
-            if current_total_income > 0:
+            if current.total_income > 0:
                 trends["gross_margin"] = (
-                    current_gross_profit / current_total_income
+                    current.gross_profit / current.total_income
                 ) * 100
-                trends["net_margin"] = (current_net_income / current_total_income) * 100
+                trends["net_margin"] = (current.net_income / current.total_income) * 100
             else:
                 trends["gross_margin"] = 0
                 trends["net_margin"] = 0
 
             # Compare with previous ratios
-            if prev_total_income > 0:
-                prev_gross_margin = (prev_gross_profit / prev_total_income) * 100
-                prev_net_margin = (prev_net_income / prev_total_income) * 100
+            if prev.total_income > 0:
+                prev_gross_margin = (prev.gross_profit / prev.total_income) * 100
+                prev_net_margin = (prev.net_income / prev.total_income) * 100
                 trends["gross_margin_change"] = (
                     trends["gross_margin"] - prev_gross_margin
                 )
@@ -419,61 +753,43 @@ class FinancialStatementsService:
 
             return trends
         except Exception as e:
-            logger.error(f"Error analyzing P&L trends: {str(e)}")
+            logger.error("Error analyzing P&L trends: %s", e)
             return {"error": str(e)}
 
     def _analyze_bs_trends(
-        self, current_bs: Dict[str, Any], prev_bs: Dict[str, Any]
+        self, current_bs: BalanceSheetStatement, prev_bs: BalanceSheetStatement
     ) -> Dict[str, Any]:
         """Analyze trends in Balance Sheet statements"""
         trends = {}
 
         try:
             # Extract key metrics from Balance Sheets
-            current_total_assets = self._extract_bs_value(current_bs, "total_assets")
-            current_current_assets = self._extract_bs_value(
-                current_bs, "current_assets"
-            )
-            current_total_liabilities = self._extract_bs_value(
-                current_bs, "total_liabilities"
-            )
-            current_current_liabilities = self._extract_bs_value(
-                current_bs, "current_liabilities"
-            )
-            current_total_equity = self._extract_bs_value(current_bs, "total_equity")
-
-            prev_total_assets = self._extract_bs_value(prev_bs, "total_assets")
-            prev_current_assets = self._extract_bs_value(prev_bs, "current_assets")
-            prev_total_liabilities = self._extract_bs_value(
-                prev_bs, "total_liabilities"
-            )
-            prev_current_liabilities = self._extract_bs_value(
-                prev_bs, "current_liabilities"
-            )
-            prev_total_equity = self._extract_bs_value(prev_bs, "total_equity")
+            current = BSMetrics.from_statement(current_bs)
+            prev = BSMetrics.from_statement(prev_bs)
+            if current.is_empty() and prev.is_empty():
+                return dict(_EMPTY_BS_TRENDS)
 
             # Calculate changes
-            trends["total_assets_change"] = self._calculate_percentage_change(
-                current_total_assets, prev_total_assets
-            )
-            trends["total_liabilities_change"] = self._calculate_percentage_change(
-                current_total_liabilities, prev_total_liabilities
-            )
-            trends["equity_change"] = self._calculate_percentage_change(
-                current_total_equity, prev_total_equity
+            (
+                trends["total_assets_change"],
+                trends["total_liabilities_change"],
+                trends["equity_change"],
+            ) = _pct_change_batch(
+                (current.total_assets, current.total_liabilities, current.total_equity),
+                (prev.total_assets, prev.total_liabilities, prev.total_equity),
             )
 
             # Calculate key ratios
-            trends["current_ratio"] = current_current_assets / max(
-                current_current_liabilities, 1
+            trends["current_ratio"] = current.current_assets / max(
+                current.current_liabilities, 1
             )
-            trends["debt_to_equity"] = current_total_liabilities / max(
-                current_total_equity, 1
+            trends["debt_to_equity"] = current.total_liabilities / max(
+                current.total_equity, 1
             )
 
             # Compare with previous ratios
-            prev_current_ratio = prev_current_assets / max(prev_current_liabilities, 1)
-            prev_debt_to_equity = prev_total_liabilities / max(prev_total_equity, 1)
+            prev_current_ratio = prev.current_assets / max(prev.current_liabilities, 1)
+            prev_debt_to_equity = prev.total_liabilities / max(prev.total_equity, 1)
 
             trends["current_ratio_change"] = (
                 trends["current_ratio"] - prev_current_ratio
@@ -484,237 +800,85 @@ class FinancialStatementsService:
 
             return trends
         except Exception as e:
-            logger.error(f"Error analyzing Balance Sheet trends: {str(e)}")
+            logger.error("Error analyzing Balance Sheet trends: %s", e)
             return {"error": str(e)}
 
     def _analyze_cf_trends(
-        self, current_cf: Dict[str, Any], prev_cf: Dict[str, Any]
+        self, current_cf: CashFlowStatement, prev_cf: CashFlowStatement
     ) -> Dict[str, Any]:
         """Analyze trends in Cash Flow statements"""
         trends = {}
 
         try:
             # Extract key metrics
-            current_operating_cash = self._extract_cf_value(
-                current_cf, "total_operating_cash_flow"
-            )
-            current_investing_cash = self._extract_cf_value(
-                current_cf, "total_investing_cash_flow"
-            )
-            current_financing_cash = self._extract_cf_value(
-                current_cf, "total_financing_cash_flow"
-            )
-            current_net_cash = self._extract_cf_value(current_cf, "net_cash_change")
-
-            prev_operating_cash = self._extract_cf_value(
-                prev_cf, "total_operating_cash_flow"
-            )
-            prev_investing_cash = self._extract_cf_value(
-                prev_cf, "total_investing_cash_flow"
-            )
-            prev_financing_cash = self._extract_cf_value(
-                prev_cf, "total_financing_cash_flow"
-            )
-            prev_net_cash = self._extract_cf_value(prev_cf, "net_cash_change")
+            current = CFMetrics.from_statement(current_cf)
+            prev = CFMetrics.from_statement(prev_cf)
+            if current.is_empty() and prev.is_empty():
+                return dict(_EMPTY_CF_TRENDS)
 
             # Calculate changes
-            trends["operating_cash_change"] = self._calculate_percentage_change(
-                current_operating_cash, prev_operating_cash
-            )
-            trends["investing_cash_change"] = self._calculate_percentage_change(
-                current_investing_cash, prev_investing_cash
-            )
-            trends["financing_cash_change"] = self._calculate_percentage_change(
-                current_financing_cash, prev_financing_cash
-            )
-            trends["net_cash_change"] = self._calculate_percentage_change(
-                current_net_cash, prev_net_cash
+            (
+                trends["operating_cash_change"],
+                trends["investing_cash_change"],
+                trends["financing_cash_change"],
+                trends["net_cash_change"],
+            ) = _pct_change_batch(
+                (
+                    current.total_operating_cash_flow,
+                    current.total_investing_cash_flow,
+                    current.total_financing_cash_flow,
+                    current.net_cash_change,
+                ),
+                (
+                    prev.total_operating_cash_flow,
+                    prev.total_investing_cash_flow,
+                    prev.total_financing_cash_flow,
+                    prev.net_cash_change,
+                ),
             )
 
             return trends
         except Exception as e:
-            logger.error(f"Error analyzing Cash Flow trends: {str(e)}")
+            logger.error("Error analyzing Cash Flow trends: %s", e)
             return {"error": str(e)}
 
-    def _calculate_percentage_change(self, current: float, previous: float) -> float:
-        """Calculate percentage change between two values"""
-        if previous == 0:
-            return 0.0
-        return ((current - previous) / abs(previous)) * 100
-
-    def _extract_pl_value(self, pl_data: Dict[str, Any], key: str) -> float:
-        """Extract numerical value from P&L data safely"""
-        try:
-            value = pl_data.get(key, 0)
-            return float(value) if value is not None else 0.0
-        except (ValueError, TypeError):
-            return 0.0
-
-    def _extract_bs_value(self, bs_data: Dict[str, Any], key: str) -> float:
-        """Extract numerical value from Balance Sheet data safely"""
-        try:
-            value = bs_data.get(key, 0)
-            return float(value) if value is not None else 0.0
-        except (ValueError, TypeError):
-            return 0.0
-
-    def _extract_cf_value(self, cf_data: Dict[str, Any], key: str) -> float:
-        """Extract numerical value from Cash Flow data safely"""
-        try:
-            value = cf_data.get(key, 0)
-            return float(value) if value is not None else 0.0
-        except (ValueError, TypeError):
-            return 0.0
-
-    def _generate_summary(self, pl_trends, bs_trends, cf_trends) -> str:
-        """Generate an overall summary of financial health"""
-        # Example summary generation
-        revenue_change = pl_trends.get("revenue_change", 0)
-        net_income_change = pl_trends.get("net_income_change", 0)
-        current_ratio = bs_trends.get("current_ratio", 0)
-        operating_cash = cf_trends.get("operating_cash_change", 0)
-
-        summary_parts = []
-
-        # Revenue analysis
-        if revenue_change > 10:
-            summary_parts.append("Revenue is growing strongly.")
-        elif revenue_change > 0:
-            summary_parts.append("Revenue is showing moderate growth.")
-        elif revenue_change < -10:
-            summary_parts.append("Revenue has declined significantly.")
-        elif revenue_change < 0:
-            summary_parts.append("Revenue has slightly decreased.")
-        else:
-            summary_parts.append("Revenue has remained stable.")
-
-        # Profitability analysis
-        if net_income_change > 10:
-            summary_parts.append("Profitability has improved significantly.")
-        elif net_income_change > 0:
-            summary_parts.append("Profitability has slightly improved.")
-        elif net_income_change < -10:
-            summary_parts.append("Profitability has declined significantly.")
-        elif net_income_change < 0:
-            summary_parts.append("Profitability has slightly decreased.")
-        else:
-            summary_parts.append("Profitability has remained stable.")
-
-        # Liquidity analysis
-        if current_ratio >= 2:
-            summary_parts.append("Liquidity position is strong.")
-        elif current_ratio >= 1:
-            summary_parts.append("Liquidity position is adequate.")
-        else:
-            summary_parts.append("Liquidity position needs attention.")
-
-        # Cash flow analysis
-        if operating_cash > 10:
-            summary_parts.append("Operating cash flow has improved significantly.")
-        elif operating_cash > 0:
-            summary_parts.append("Operating cash flow has slightly improved.")
-        elif operating_cash < -10:
-            summary_parts.append("Operating cash flow has declined significantly.")
-        elif operating_cash < 0:
-            summary_parts.append("Operating cash flow has slightly decreased.")
-        else:
-            summary_parts.append("Operating cash flow has remained stable.")
-
-        return " ".join(summary_parts)
-
-    def _extract_positive_insights(self, pl_trends, bs_trends, cf_trends) -> str:
-        """Extract positive insights from the financial analysis"""
-        insights = []
-
-        # Check for positive trends
-        if pl_trends.get("revenue_change", 0) > 0:
-            insights.append(f"Revenue increased by {pl_trends['revenue_change']:.1f}%")
-
-        if pl_trends.get("net_income_change", 0) > 0:
-            insights.append(
-                f"Net income improved by {pl_trends['net_income_change']:.1f}%"
-            )
-
-        if pl_trends.get("gross_margin_change", 0) > 0:
-            insights.append(
-                f"Gross margin improved by {pl_trends['gross_margin_change']:.1f} percentage points"
-            )
-
-        if bs_trends.get("current_ratio", 0) > 1.5:
-            insights.append("Strong short-term liquidity position")
-
-        if cf_trends.get("operating_cash_change", 0) > 0:
-            insights.append("Improving operating cash flow")
-
-        return (
-            ", ".join(insights)
-            if insights
-            else "No significant positive trends identified."
-        )
-
-    def _extract_concerns(self, pl_trends, bs_trends, cf_trends) -> str:
-        """Extract areas of concern from the financial analysis"""
-        concerns = []
-
-        # Check for negative trends
-        if pl_trends.get("revenue_change", 0) < 0:
-            concerns.append(
-                f"Revenue decreased by {abs(pl_trends['revenue_change']):.1f}%"
-            )
-
-        if pl_trends.get("net_income_change", 0) < 0:
-            concerns.append(
-                f"Net income decreased by {abs(pl_trends['net_income_change']):.1f}%"
-            )
-
-        if pl_trends.get("expenses_change", 0) > pl_trends.get("revenue_change", 0):
-            concerns.append("Expenses growing faster than revenue")
+    def _build_narrative(self, pl_trends, bs_trends, cf_trends) -> Narrative:
+        """Generate the summary, insights, concerns and recommendations in one pass"""
+        # Read each trend value once
+        values = {
+            "revenue_change": pl_trends.get("revenue_change", 0),
+            "net_income_change": pl_trends.get("net_income_change", 0),
+            "gross_margin_change": pl_trends.get("gross_margin_change", 0),
+            "expenses_change": pl_trends.get("expenses_change", 0),
+            "current_ratio": bs_trends.get("current_ratio", 0),
+            "debt_to_equity": bs_trends.get("debt_to_equity", 0),
+            "operating_cash_change": cf_trends.get("operating_cash_change", 0),
+        }
 
-        if bs_trends.get("current_ratio", 0) < 1:
-            concerns.append(
-                "Current ratio below 1.0 indicates potential liquidity issues"
+        summary = " ".join(
+            (
+                _REVENUE_SUMMARY[_trend_band(values["revenue_change"])],
+                _PROFITABILITY_SUMMARY[_trend_band(values["net_income_change"])],
+                _LIQUIDITY_SUMMARY[
+                    bisect_right(_LIQUIDITY_THRESHOLDS, values["current_ratio"])
+                ],
+                _OPERATING_CASH_SUMMARY[_trend_band(values["operating_cash_change"])],
             )
-
-        if bs_trends.get("debt_to_equity", 0) > 2:
-            concerns.append("High debt-to-equity ratio may indicate excessive leverage")
-
-        if cf_trends.get("operating_cash_change", 0) < 0:
-            concerns.append("Declining operating cash flow")
-
-        return (
-            ", ".join(concerns) if concerns else "No significant concerns identified."
         )
 
-    def _generate_recommendations(self, pl_trends, bs_trends, cf_trends) -> str:
-        """Generate recommendations based on financial analysis"""
-        recommendations = []
-
-        # Revenue recommendations
-        if pl_trends.get("revenue_change", 0) < 0:
-            recommendations.append("Focus on sales growth initiatives")
-
-        # Expense recommendations
-        if pl_trends.get("expenses_change", 0) > pl_trends.get("revenue_change", 0):
-            recommendations.append("Implement cost control measures")
-
-        # Margin recommendations
-        if pl_trends.get("gross_margin_change", 0) < 0:
-            recommendations.append("Review pricing strategy and cost of goods sold")
-
-        # Liquidity recommendations
-        if bs_trends.get("current_ratio", 0) < 1:
-            recommendations.append("Improve working capital management")
-
-        # Leverage recommendations
-        if bs_trends.get("debt_to_equity", 0) > 2:
-            recommendations.append("Consider debt reduction strategies")
-
-        # Cash flow recommendations
-        if cf_trends.get("operating_cash_change", 0) < 0:
-            recommendations.append("Focus on improving cash conversion cycle")
+        buckets = {"positive": [], "concern": [], "recommendation": []}
+        for bucket, applies, message, key in _NARRATIVE_RULES:
+            if applies(values):
+                buckets[bucket].append(
+                    message if key is None else message.format(abs(values[key]))
+                )
 
-        return (
-            ", ".join(recommendations)
-            if recommendations
-            else "Continue monitoring financial performance."
+        return Narrative(
+            summary=summary,
+            positive_insights=", ".join(buckets["positive"])
+            or "No significant positive trends identified.",
+            concerns=", ".join(buckets["concern"])
+            or "No significant concerns identified.",
+            recommendations=", ".join(buckets["recommendation"])
+            or "Continue monitoring financial performance.",
         )
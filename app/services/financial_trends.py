@@ -1,11 +1,43 @@
 # app/services/financial_trends.py
+from bisect import bisect_left, bisect_right
+import calendar
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import Dict, List, Any, Optional
 from .quickbooks import QuickBooksService
 
 logger = logging.getLogger(__name__)
 
+# P&L summary row groups and the metric each one reports
+_PL_GROUP_METRICS = {
+    "Income": "total_revenue",
+    "GrossProfit": "gross_profit",
+    "Expenses": "total_expenses",
+    "NetIncome": "net_income",
+}
+
+# Overall trend labels and their insight, from weakest to strongest
+_OVERALL_TRENDS = (
+    (
+        "decline",
+        "Your revenue has been declining. Consider reviewing your sales strategy.",
+    ),
+    ("stable", "Your business appears stable with minimal growth."),
+    ("moderate_growth", "Your business is showing moderate growth."),
+    (
+        "strong_growth",
+        "Your business is showing strong growth in both revenue and profit.",
+    ),
+)
+
+
+def _positive_base_growth(values: List[float], steps: List[int]) -> List[float]:
+    """Percent change at each step, or 0 where the previous value isn't positive"""
+    return [
+        ((values[i] - values[i - 1]) / values[i - 1]) * 100 if values[i - 1] > 0 else 0
+        for i in steps
+    ]
+
 
 class FinancialTrendsService:
     def __init__(self, qb_service: QuickBooksService):
@@ -25,51 +57,45 @@ class FinancialTrendsService:
             Dict containing monthly P&L trend data
         """
         try:
-            # Generate list of month periods to analyze
-            end_date = datetime.now()
+            # Generate list of month periods to analyze, newest first
+            today = datetime.now()
+            year, month = today.year, today.month
             periods = []
 
             for i in range(months):
-                # Calculate period start/end
-                current_month_end = (
-                    end_date.replace(day=1) - timedelta(days=1) if i > 0 else end_date
-                )
-                current_month_start = current_month_end.replace(day=1)
-
-                # Format dates for API
-                start_date_str = current_month_start.strftime("%Y-%m-%d")
-                end_date_str = current_month_end.strftime("%Y-%m-%d")
-
-                # Add to periods list
+                # The current month runs to today; earlier months are complete
+                last_day = today.day if i == 0 else calendar.monthrange(year, month)[1]
                 periods.append(
                     {
-                        "month": current_month_start.strftime("%b %Y"),
-                        "start_date": start_date_str,
-                        "end_date": end_date_str,
+                        "month": f"{calendar.month_abbr[month]} {year}",
+                        "start_date": f"{year:04d}-{month:02d}-01",
+                        "end_date": f"{year:04d}-{month:02d}-{last_day:02d}",
                     }
                 )
 
                 # Move to previous month
-                end_date = current_month_start - timedelta(days=1)
+                year, month = (year, month - 1) if month > 1 else (year - 1, 12)
 
             # Reverse chronological order to have oldest first
             periods.reverse()
 
-            # Get P&L data for each period
-            trend_data = []
-            for period in periods:
-                report_data = await self.qb_service.get_report(
-                    realm_id=realm_id,
-                    report_type="ProfitAndLoss",
-                    params={
-                        "start_date": period["start_date"],
-                        "end_date": period["end_date"],
-                        "minorversion": "65",
-                    },
-                )
+            # Fetch every month in one report, one column per month
+            report_data = await self.qb_service.get_report(
+                realm_id=realm_id,
+                report_type="ProfitAndLoss",
+                params={
+                    "start_date": periods[0]["start_date"],
+                    "end_date": periods[-1]["end_date"],
+                    "summarize_column_by": "Month",
+                    "minorversion": "65",
+                },
+            )
 
+            # Column 0 holds the row labels and the last column the range total
+            trend_data = []
+            for column, period in enumerate(periods, start=1):
                 # Extract key metrics from the report
-                metrics = self._extract_pl_metrics(report_data)
+                metrics = self._extract_pl_metrics(report_data, column)
                 metrics["period"] = period["month"]
 
                 trend_data.append(metrics)
@@ -83,9 +109,11 @@ class FinancialTrendsService:
             logger.error(f"Error getting P&L trend data: {str(e)}")
             raise
 
-    def _extract_pl_metrics(self, pl_report: Dict[str, Any]) -> Dict[str, float]:
+    def _extract_pl_metrics(
+        self, pl_report: Dict[str, Any], column: int = 1
+    ) -> Dict[str, float]:
         """
-        Extract key metrics from a Profit & Loss report
+        Extract key metrics from one value column of a Profit & Loss report
         """
         metrics = {
             "total_revenue": 0,
@@ -99,38 +127,28 @@ class FinancialTrendsService:
             rows = pl_report.get("Rows", {}).get("Row", [])
 
             for row in rows:
-                if row.get("group") == "Income" and row.get("Summary"):
-                    metrics["total_revenue"] = float(
-                        row["Summary"]["ColData"][1]["value"]
-                    )
-                elif row.get("group") == "GrossProfit" and row.get("Summary"):
-                    metrics["gross_profit"] = float(
-                        row["Summary"]["ColData"][1]["value"]
-                    )
-                elif row.get("group") == "Expenses" and row.get("Summary"):
-                    metrics["total_expenses"] = float(
-                        row["Summary"]["ColData"][1]["value"]
-                    )
-                elif row.get("group") == "NetIncome" and row.get("Summary"):
-                    metrics["net_income"] = float(row["Summary"]["ColData"][1]["value"])
-
-            # Calculate margins
-            if metrics["total_revenue"] > 0:
-                metrics["gross_margin"] = (
-                    metrics["gross_profit"] / metrics["total_revenue"]
-                ) * 100
-                metrics["net_margin"] = (
-                    metrics["net_income"] / metrics["total_revenue"]
-                ) * 100
-            else:
-                metrics["gross_margin"] = 0
-                metrics["net_margin"] = 0
-
-            return metrics
+                key = _PL_GROUP_METRICS.get(row.get("group"))
+                summary = row.get("Summary") if key else None
+                if summary:
+                    # Months without activity come back as blank cells
+                    metrics[key] = float(summary["ColData"][column]["value"] or 0)
 
         except Exception as e:
             logger.error(f"Error extracting P&L metrics: {str(e)}")
-            return metrics
+
+        # Calculate margins
+        if metrics["total_revenue"] > 0:
+            metrics["gross_margin"] = (
+                metrics["gross_profit"] / metrics["total_revenue"]
+            ) * 100
+            metrics["net_margin"] = (
+                metrics["net_income"] / metrics["total_revenue"]
+            ) * 100
+        else:
+            metrics["gross_margin"] = 0
+            metrics["net_margin"] = 0
+
+        return metrics
 
     def _analyze_pl_trends(self, trend_data: List[Dict[str, Any]]) -> Dict[str, Any]:
         """
@@ -139,88 +157,51 @@ class FinancialTrendsService:
         if not trend_data or len(trend_data) < 2:
             return {"status": "insufficient_data"}
 
-        analysis = {
-            "revenue_growth": [],
-            "expense_growth": [],
-            "profit_growth": [],
-            "overall_trend": "",
-            "insights": [],
-        }
-
-        # Calculate period-over-period growth
-        for i in range(1, len(trend_data)):
-            current = trend_data[i]
-            previous = trend_data[i - 1]
-
-            # Skip if previous revenue is zero (avoid division by zero)
-            if previous["total_revenue"] == 0:
-                continue
-
-            revenue_growth = (
-                (current["total_revenue"] - previous["total_revenue"])
-                / previous["total_revenue"]
-            ) * 100
-            expense_growth = (
-                (
-                    (current["total_expenses"] - previous["total_expenses"])
-                    / previous["total_expenses"]
-                )
-                * 100
-                if previous["total_expenses"] > 0
-                else 0
-            )
-            profit_growth = (
-                (
-                    (current["net_income"] - previous["net_income"])
-                    / previous["net_income"]
-                )
-                * 100
-                if previous["net_income"] > 0
-                else 0
-            )
+        # Column views of the trend data
+        periods = [data["period"] for data in trend_data]
+        revenue = [data["total_revenue"] for data in trend_data]
+        expenses = [data["total_expenses"] for data in trend_data]
+        net_income = [data["net_income"] for data in trend_data]
 
-            analysis["revenue_growth"].append(
-                {"period": current["period"], "growth": revenue_growth}
-            )
+        # Calculate period-over-period growth, skipping periods whose previous
+        # revenue is zero (avoid division by zero)
+        steps = [i for i in range(1, len(trend_data)) if revenue[i - 1] != 0]
+        if not steps:
+            return {"status": "insufficient_data"}
 
-            analysis["expense_growth"].append(
-                {"period": current["period"], "growth": expense_growth}
-            )
+        revenue_growth = [
+            ((revenue[i] - revenue[i - 1]) / revenue[i - 1]) * 100 for i in steps
+        ]
+        expense_growth = _positive_base_growth(expenses, steps)
+        profit_growth = _positive_base_growth(net_income, steps)
 
-            analysis["profit_growth"].append(
-                {"period": current["period"], "growth": profit_growth}
+        analysis = {
+            name: [
+                {"period": periods[i], "growth": growth}
+                for i, growth in zip(steps, values)
+            ]
+            for name, values in (
+                ("revenue_growth", revenue_growth),
+                ("expense_growth", expense_growth),
+                ("profit_growth", profit_growth),
             )
+        }
+        analysis["overall_trend"] = ""
+        analysis["insights"] = []
 
         # Determine overall trend
-        if len(analysis["revenue_growth"]) > 0:
-            avg_revenue_growth = sum(
-                item["growth"] for item in analysis["revenue_growth"]
-            ) / len(analysis["revenue_growth"])
-            avg_profit_growth = (
-                sum(item["growth"] for item in analysis["profit_growth"])
-                / len(analysis["profit_growth"])
-                if analysis["profit_growth"]
-                else 0
+        avg_revenue_growth = sum(revenue_growth) / len(steps)
+        avg_profit_growth = sum(profit_growth) / len(steps)
+
+        if avg_revenue_growth > 10 and avg_profit_growth > 10:
+            band = len(_OVERALL_TRENDS) - 1
+        else:
+            # Below 0 declines; 0 through 5 is stable; above 5 is moderate growth
+            band = bisect_right((0,), avg_revenue_growth) + bisect_left(
+                (5,), avg_revenue_growth
             )
-
-            if avg_revenue_growth > 10 and avg_profit_growth > 10:
-                analysis["overall_trend"] = "strong_growth"
-                analysis["insights"].append(
-                    "Your business is showing strong growth in both revenue and profit."
-                )
-            elif avg_revenue_growth > 5:
-                analysis["overall_trend"] = "moderate_growth"
-                analysis["insights"].append("Your business is showing moderate growth.")
-            elif avg_revenue_growth < 0:
-                analysis["overall_trend"] = "decline"
-                analysis["insights"].append(
-                    "Your revenue has been declining. Consider reviewing your sales strategy."
-                )
-            else:
-                analysis["overall_trend"] = "stable"
-                analysis["insights"].append(
-                    "Your business appears stable with minimal growth."
-                )
+        analysis["overall_trend"], insight = _OVERALL_TRENDS[band]
+        analysis["insights"].append(insight)
 
         # Add additional insights
         latest = trend_data[-1]
@@ -231,7 +212,7 @@ class FinancialTrendsService:
 
         if len(trend_data) >= 3:
             # Check for expense trend
-            recent_expenses = [data["total_expenses"] for data in trend_data[-3:]]
+            recent_expenses = expenses[-3:]
             if recent_expenses[2] > recent_expenses[1] > recent_expenses[0]:
                 analysis["insights"].append(
                     "Your expenses have been consistently increasing. Review your cost structure."
@@ -0,0 +1,188 @@
+# app/services/qb_cache.py
+import hashlib
+import logging
+import os
+import shutil
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Reports for open periods can still change, so only keep them briefly
+OPEN_PERIOD_TTL = 10 * 60
+# Month-end close adjustments can still land in the month after the close
+RECENT_PERIOD_TTL = 24 * 60 * 60
+# Older periods rarely change; backdated entries show up within this long
+CLOSED_PERIOD_TTL = 30 * 24 * 60 * 60
+# Parsed reports are kept in memory just long enough to absorb re-renders
+MEMORY_TTL = 30
+
+
+def _month_start(day: date, months_back: int = 0) -> date:
+    """First day of the month months_back months before day's month"""
+    for _ in range(months_back):
+        day = day.replace(day=1) - timedelta(days=1)
+    return day.replace(day=1)
+
+
+def report_ttl(params: Dict[str, Any], today: Optional[date] = None) -> float:
+    """
+    Pick how long a report may be served from cache based on its period.
+
+    Periods ending in the current or previous month are still open or in
+    their month-end close and are kept for 10 minutes, as is anything
+    without a parseable end date (including relative date macros). Periods
+    ending the month before that are kept for a day, and older ones for 30
+    days. Nothing else invalidates closed periods short of a disconnect, so
+    a backdated entry can take that long to appear in an older report.
+    """
+    end_date = params.get("end_date") or params.get("as_of")
+    if not end_date:
+        return OPEN_PERIOD_TTL
+
+    try:
+        end = date.fromisoformat(str(end_date))
+    except ValueError:
+        return OPEN_PERIOD_TTL
+
+    today = today or date.today()
+    if end >= _month_start(today, 1):
+        return OPEN_PERIOD_TTL
+    if end >= _month_start(today, 2):
+        return RECENT_PERIOD_TTL
+    return CLOSED_PERIOD_TTL
+
+
+class FileCache:
+    """On-disk cache of raw QBO report bodies, one file per request"""
+
+    def __init__(self, root: str = ".cache"):
+        self.root = Path(root)
+        self._known_dirs = set()
+
+    def _realm_dir(self, realm_id: str) -> Path:
+        """Directory holding a realm's reports, named by a hash of the realm ID"""
+        # Hashed so a realm ID taken from a URL can never point outside root
+        return self.root / hashlib.md5(realm_id.encode()).hexdigest()
+
+    def _path(self, realm_id: str, report_type: str, params: Dict[str, Any]) -> Path:
+        """Build the cache file path for a report request"""
+        digest = hashlib.md5(
+            orjson.dumps(params, option=orjson.OPT_SORT_KEYS)
+        ).hexdigest()
+        return self._realm_dir(realm_id) / report_type / f"{digest}.json"
+
+    def get(
+        self, realm_id: str, report_type: str, params: Dict[str, Any], ttl: float
+    ) -> Optional[bytes]:
+        """Return the cached report body, or None when missing or expired"""
+        path = self._path(realm_id, report_type, params)
+        try:
+            age = time.time() - path.stat().st_mtime
+            if age < ttl:
+                body = path.read_bytes()
+                logger.debug("Report cache hit: %s %s", report_type, params)
+                return body
+            # Expired entries would only be replaced on the next set
+            path.unlink()
+        except OSError:
+            pass
+
+        logger.debug("Report cache miss: %s %s", report_type, params)
+        return None
+
+    def set(
+        self, realm_id: str, report_type: str, params: Dict[str, Any], body: bytes
+    ) -> None:
+        """Store a report body, replacing any previous entry atomically"""
+        path = self._path(realm_id, report_type, params)
+        try:
+            if path.parent not in self._known_dirs:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                self._known_dirs.add(path.parent)
+            tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_bytes(body)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # Re-create the directory next time in case it was removed
+            self._known_dirs.discard(path.parent)
+            logger.warning("Could not cache %s report: %s", report_type, e)
+
+    def invalidate(self, realm_id: str) -> None:
+        """Remove every cached report for a realm"""
+        shutil.rmtree(self._realm_dir(realm_id), ignore_errors=True)
+        self._known_dirs.clear()
+
+
+class MemoryCache:
+    """
+    Bounded in-process LRU of parsed reports with a short TTL.
+
+    Expired entries that carry an ETag are kept so the next request can be
+    revalidated with If-None-Match instead of downloading the report again.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = MEMORY_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+
+    @staticmethod
+    def _key(realm_id: str, report_type: str, params: Dict[str, Any]):
+        return realm_id, report_type, frozenset(params.items())
+
+    def get(
+        self, realm_id: str, report_type: str, params: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """Return the cached report, or None when missing or expired"""
+        key = self._key(realm_id, report_type, params)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        stored_at, etag, report = entry
+        if time.monotonic() - stored_at >= self.ttl:
+            if etag is None:
+                del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return report
+
+    def get_validator(
+        self, realm_id: str, report_type: str, params: Dict[str, Any]
+    ) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Return (etag, report) for a cached entry, fresh or not, if it has one"""
+        entry = self._entries.get(self._key(realm_id, report_type, params))
+        if entry is None or entry[1] is None:
+            return None
+        return entry[1], entry[2]
+
+    def set(
+        self,
+        realm_id: str,
+        report_type: str,
+        params: Dict[str, Any],
+        report: Dict[str, Any],
+        etag: Optional[str] = None,
+    ) -> None:
+        """Store a parsed report, evicting the least recently used if full"""
+        key = self._key(realm_id, report_type, params)
+        self._entries[key] = (time.monotonic(), etag, report)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, realm_id: str) -> None:
+        """Remove every cached report for a realm"""
+        for key in [key for key in self._entries if key[0] == realm_id]:
+            del self._entries[key]
+
+
+report_cache = FileCache(os.getenv("QB_CACHE_DIR", ".cache"))
+report_memory = MemoryCache()
@@ -0,0 +1,50 @@
+"""Add unique index on quickbooks_tokens.realm_id
+
+Revision ID: 3c1f2a7d9b04
+Revises: 09643285cf9e
+Create Date: 2026-10-15 10:12:41.318204
+
+"""
+
+from typing import Optional, Sequence, Set, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "3c1f2a7d9b04"
+down_revision: Union[str, None] = "09643285cf9e"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _realm_id_indexes() -> Optional[Set[str]]:
+    """Index names on quickbooks_tokens, or None if the table doesn't exist"""
+    # The previous revision drops quickbooks_tokens; the app re-creates it
+    # (with this index) through Base.metadata.create_all on startup
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("quickbooks_tokens"):
+        return None
+    return {index["name"] for index in inspector.get_indexes("quickbooks_tokens")}
+
+
+def upgrade() -> None:
+    # Duplicate realm_id rows must be removed before upgrading; store_tokens'
+    # ON CONFLICT (realm_id) upsert relies on this index
+    indexes = _realm_id_indexes()
+    if indexes is None or "ix_quickbooks_tokens_realm_id" in indexes:
+        return
+
+    op.create_index(
+        op.f("ix_quickbooks_tokens_realm_id"),
+        "quickbooks_tokens",
+        ["realm_id"],
+        unique=True,
+    )
+
+
+def downgrade() -> None:
+    if "ix_quickbooks_tokens_realm_id" not in (_realm_id_indexes() or ()):
+        return
+
+    op.drop_index(op.f("ix_quickbooks_tokens_realm_id"), table_name="quickbooks_tokens")
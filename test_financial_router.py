@@ -0,0 +1,80 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.database import get_db
+from app.routers import financial
+
+
+class FakeSession:
+    """Just enough of a Session for the disconnect route"""
+
+    def __init__(self, token_record=None):
+        self.token_record = token_record
+        self.deleted = []
+        self.committed = False
+
+    def query(self, model):
+        return self
+
+    def filter(self, *criteria):
+        return self
+
+    def first(self):
+        return self.token_record
+
+    def delete(self, record):
+        self.deleted.append(record)
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        pass
+
+
+def _client(db, monkeypatch):
+    forgotten = []
+
+    async def disconnect_realm(realm_id):
+        forgotten.append(realm_id)
+
+    monkeypatch.setattr(financial, "disconnect_realm", disconnect_realm)
+
+    app = FastAPI()
+    app.include_router(financial.router, prefix="/api")
+    app.dependency_overrides[get_db] = lambda: db
+    return TestClient(app), forgotten
+
+
+def test_disconnect_deletes_tokens_and_forgets_realm(monkeypatch):
+    db = FakeSession(token_record=object())
+    client, forgotten = _client(db, monkeypatch)
+
+    response = client.post("/api/financial/disconnect/1234567890")
+
+    assert response.status_code == 200
+    assert response.json()["success"] is True
+    assert db.committed
+    assert forgotten == ["1234567890"]
+
+
+def test_disconnect_unknown_realm_leaves_caches_alone(monkeypatch):
+    db = FakeSession()
+    client, forgotten = _client(db, monkeypatch)
+
+    response = client.post("/api/financial/disconnect/1234567890")
+
+    assert response.json()["success"] is False
+    assert forgotten == []
+
+
+def test_disconnect_rejects_non_numeric_realm_ids(monkeypatch):
+    db = FakeSession(token_record=object())
+    client, forgotten = _client(db, monkeypatch)
+
+    for realm_id in ("%2E%2E", "abc", "12%2F34"):
+        response = client.post(f"/api/financial/disconnect/{realm_id}")
+        assert response.status_code in (404, 422)
+
+    assert db.deleted == []
+    assert forgotten == []
@@ -0,0 +1,49 @@
+from app.services.financial_trends import FinancialTrendsService
+
+
+def _summary_row(group, *values):
+    return {
+        "group": group,
+        "Summary": {"ColData": [{"value": group}] + [{"value": v} for v in values]},
+    }
+
+
+# Two months plus the range total, with no income booked in the second month
+MONTHLY_PL_REPORT = {
+    "Rows": {
+        "Row": [
+            _summary_row("Income", "1000.00", "", "1000.00"),
+            _summary_row("GrossProfit", "600.00", "", "600.00"),
+            _summary_row("Expenses", "400.00", "50.00", "450.00"),
+            _summary_row("NetIncome", "200.00", "-50.00", "150.00"),
+        ]
+    }
+}
+
+
+def test_extract_pl_metrics_treats_blank_cells_as_zero():
+    service = FinancialTrendsService(None)
+
+    metrics = service._extract_pl_metrics(MONTHLY_PL_REPORT, column=2)
+
+    assert metrics["total_revenue"] == 0
+    assert metrics["gross_profit"] == 0
+    assert metrics["total_expenses"] == 50.0
+    assert metrics["net_income"] == -50.0
+    assert metrics["gross_margin"] == 0
+    assert metrics["net_margin"] == 0
+
+
+def test_pl_trend_with_blank_latest_month():
+    service = FinancialTrendsService(None)
+    trend_data = [
+        dict(service._extract_pl_metrics(MONTHLY_PL_REPORT, column), period=period)
+        for column, period in enumerate(("Jan 2024", "Feb 2024"), start=1)
+    ]
+
+    assert trend_data[0]["gross_margin"] == 60.0
+    assert trend_data[0]["net_margin"] == 20.0
+
+    analysis = service._analyze_pl_trends(trend_data)
+
+    assert analysis["overall_trend"] == "decline"
@@ -0,0 +1,80 @@
+from datetime import date
+
+from app.services.qb_cache import (
+    CLOSED_PERIOD_TTL,
+    OPEN_PERIOD_TTL,
+    RECENT_PERIOD_TTL,
+    FileCache,
+    report_ttl,
+)
+
+TODAY = date(2024, 3, 15)
+
+
+def test_report_ttl_closed_period():
+    assert report_ttl({"end_date": "2023-12-31"}, TODAY) == CLOSED_PERIOD_TTL
+    assert report_ttl({"as_of": "2023-06-30"}, TODAY) == CLOSED_PERIOD_TTL
+
+
+def test_report_ttl_recently_closed_period():
+    assert report_ttl({"end_date": "2024-01-01"}, TODAY) == RECENT_PERIOD_TTL
+    assert report_ttl({"end_date": "2024-01-31"}, TODAY) == RECENT_PERIOD_TTL
+
+
+def test_report_ttl_open_period():
+    # The previous month is still in its month-end close
+    assert report_ttl({"end_date": "2024-02-01"}, TODAY) == OPEN_PERIOD_TTL
+    assert report_ttl({"end_date": "2024-02-29"}, TODAY) == OPEN_PERIOD_TTL
+    assert report_ttl({"end_date": "2024-03-01"}, TODAY) == OPEN_PERIOD_TTL
+    assert report_ttl({"end_date": "2024-03-31"}, TODAY) == OPEN_PERIOD_TTL
+    assert report_ttl({"date_macro": "This Month"}, TODAY) == OPEN_PERIOD_TTL
+    assert report_ttl({"end_date": "not-a-date"}, TODAY) == OPEN_PERIOD_TTL
+
+
+def test_report_ttl_across_year_end():
+    today = date(2024, 1, 10)
+    assert report_ttl({"end_date": "2023-12-31"}, today) == OPEN_PERIOD_TTL
+    assert report_ttl({"end_date": "2023-11-30"}, today) == RECENT_PERIOD_TTL
+    assert report_ttl({"end_date": "2023-10-31"}, today) == CLOSED_PERIOD_TTL
+
+
+def test_file_cache_invalidate(tmp_path):
+    cache = FileCache(str(tmp_path))
+    params = {"end_date": "2024-02-29"}
+    cache.set("123", "ProfitAndLoss", params, b"{}")
+    cache.set("456", "ProfitAndLoss", params, b"{}")
+
+    cache.invalidate("123")
+
+    assert cache.get("123", "ProfitAndLoss", params, CLOSED_PERIOD_TTL) is None
+    assert cache.get("456", "ProfitAndLoss", params, CLOSED_PERIOD_TTL) == b"{}"
+    # The realm's directory is re-created on the next write
+    cache.set("123", "ProfitAndLoss", params, b"[]")
+    assert cache.get("123", "ProfitAndLoss", params, CLOSED_PERIOD_TTL) == b"[]"
+
+
+def test_file_cache_drops_expired_entries(tmp_path):
+    cache = FileCache(str(tmp_path))
+    params = {"end_date": "2024-02-29"}
+    cache.set("123", "ProfitAndLoss", params, b"{}")
+
+    assert cache.get("123", "ProfitAndLoss", params, 0) is None
+    assert not cache._path("123", "ProfitAndLoss", params).exists()
+
+
+def test_file_cache_keeps_realm_ids_inside_root(tmp_path):
+    root = tmp_path / "cache"
+    cache = FileCache(str(root))
+    sibling = tmp_path / "keep.txt"
+    sibling.write_text("keep")
+    params = {"end_date": "2024-02-29"}
+
+    cache.set("../escape", "ProfitAndLoss", params, b"{}")
+    cache.invalidate("..")
+    cache.invalidate(".")
+
+    assert sibling.exists()
+    assert not (tmp_path / "escape").exists()
+    assert (
+        cache._path("../escape", "ProfitAndLoss", params).parent.parent.parent == root
+    )
@@ -0,0 +1,310 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import aiohttp
+import pytest
+
+from app.services import qb_cache
+from app.services import quickbooks as qb
+
+
+class FakeResponse:
+    """Stands in for an aiohttp response used as an async context manager"""
+
+    def __init__(self, status, body=b"{}", headers=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def read(self):
+        return self.body
+
+    async def text(self):
+        return self.body.decode()
+
+
+class FakeSession:
+    """Replays canned responses and records the requests made"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def _next(self, method, url, kwargs):
+        self.requests.append((method, url, kwargs))
+        response = self.responses.pop(0)
+        if isinstance(response, BaseException):
+            raise response
+        return response
+
+    def get(self, url, **kwargs):
+        return self._next("GET", url, kwargs)
+
+    def post(self, url, **kwargs):
+        return self._next("POST", url, kwargs)
+
+
+@pytest.fixture
+def session(monkeypatch):
+    fake = FakeSession()
+
+    async def get_session():
+        return fake
+
+    monkeypatch.setattr(qb, "get_session", get_session)
+    monkeypatch.setattr(qb, "_TOKEN_AUTH_HEADER", "Basic dGVzdDp0ZXN0")
+    return fake
+
+
+@pytest.mark.parametrize(
+    "status, error",
+    [
+        (400, qb.QBAuthError),
+        (401, qb.QBAuthError),
+        (429, qb.QBApiError),
+        (500, qb.QBApiError),
+        (503, qb.QBApiError),
+    ],
+)
+def test_post_token_maps_error_statuses(session, status, error):
+    session.responses.append(FakeResponse(status, b'{"error": "x"}'))
+
+    with pytest.raises(error):
+        asyncio.run(qb._post_token({"grant_type": "refresh_token"}))
+
+
+def test_post_token_parses_tokens(session):
+    session.responses.append(
+        FakeResponse(200, b'{"access_token": "a", "refresh_token": "r", "x": 1}')
+    )
+
+    token = asyncio.run(qb._post_token({"grant_type": "refresh_token"}))
+
+    assert (token.access_token, token.refresh_token) == ("a", "r")
+
+
+REALM_ID = "1234567890"
+REPORT_PARAMS = {"start_date": "2024-03-01", "end_date": "2024-03-31"}
+
+
+@pytest.fixture
+def state(monkeypatch, tmp_path):
+    """Fresh module-level caches, with a cached token for REALM_ID"""
+    for name in ("_token_cache", "_refresh_locks", "_inflight_reports"):
+        monkeypatch.setattr(qb, name, {})
+    monkeypatch.setattr(qb, "_request_slots", asyncio.Semaphore(8))
+    monkeypatch.setattr(qb, "report_cache", qb_cache.FileCache(str(tmp_path)))
+    monkeypatch.setattr(qb, "report_memory", qb_cache.MemoryCache())
+    qb._token_cache[REALM_ID] = ("cached-token", time.time() + 3600)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Record backoff delays instead of waiting them out"""
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def sleep(delay, *args):
+        delays.append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(qb.asyncio, "sleep", sleep)
+    return delays
+
+
+class GatedFetch:
+    """Fake _get_with_retry that holds every request until released"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def __call__(self, url, **kwargs):
+        self.calls.append((url, kwargs))
+        self.started.set()
+        await self.release.wait()
+        return self.responses.pop(0)
+
+
+def test_concurrent_report_requests_share_one_fetch(state, monkeypatch):
+    async def run():
+        fetch = GatedFetch((200, b'{"Header": {}}', None))
+        monkeypatch.setattr(qb, "_get_with_retry", fetch)
+        service = qb.QuickBooksService(None)
+
+        requests = [
+            asyncio.ensure_future(
+                service.get_report(REALM_ID, "ProfitAndLoss", dict(REPORT_PARAMS))
+            )
+            for _ in range(5)
+        ]
+        await fetch.started.wait()
+        fetch.release.set()
+
+        return fetch, await asyncio.gather(*requests)
+
+    fetch, reports = asyncio.run(run())
+
+    assert len(fetch.calls) == 1
+    assert reports == [{"Header": {}}] * 5
+    assert qb._inflight_reports == {}
+
+
+def test_cancelling_first_report_request_keeps_shared_fetch(state, monkeypatch):
+    async def run():
+        fetch = GatedFetch((200, b'{"Header": {}}', None))
+        monkeypatch.setattr(qb, "_get_with_retry", fetch)
+
+        first = asyncio.ensure_future(
+            qb.QuickBooksService(None).get_report(
+                REALM_ID, "ProfitAndLoss", dict(REPORT_PARAMS)
+            )
+        )
+        await fetch.started.wait()
+        others = [
+            asyncio.ensure_future(
+                qb.QuickBooksService(None).get_report(
+                    REALM_ID, "ProfitAndLoss", dict(REPORT_PARAMS)
+                )
+            )
+            for _ in range(3)
+        ]
+        await asyncio.sleep(0)
+
+        first.cancel()
+        fetch.release.set()
+
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return fetch, await asyncio.gather(*others)
+
+    fetch, reports = asyncio.run(run())
+
+    assert len(fetch.calls) == 1
+    assert reports == [{"Header": {}}] * 3
+
+
+def test_expired_report_is_revalidated_with_etag(state, monkeypatch):
+    # Expire both cache layers straight away, keeping the memory ETag
+    monkeypatch.setattr(qb, "report_ttl", lambda params: 0)
+    monkeypatch.setattr(qb, "report_memory", qb_cache.MemoryCache(ttl=0))
+
+    async def run():
+        fetch = GatedFetch((200, b'{"Header": {}}', '"v1"'), (304, b"", None))
+        fetch.release.set()
+        monkeypatch.setattr(qb, "_get_with_retry", fetch)
+        service = qb.QuickBooksService(None)
+
+        first = await service.get_report(REALM_ID, "ProfitAndLoss", REPORT_PARAMS)
+        second = await service.get_report(REALM_ID, "ProfitAndLoss", REPORT_PARAMS)
+        return fetch, first, second
+
+    fetch, first, second = asyncio.run(run())
+
+    assert second is first
+    assert "If-None-Match" not in fetch.calls[0][1]["headers"]
+    assert fetch.calls[1][1]["headers"]["If-None-Match"] == '"v1"'
+
+
+class FakeDb:
+    """Session returning one stored token row that has already expired"""
+
+    def __init__(self):
+        self.row = SimpleNamespace(
+            access_token="expired-token",
+            refresh_token="refresh-token",
+            expires_at=datetime.now() - timedelta(minutes=1),
+        )
+
+    def execute(self, statement, params=None):
+        return SimpleNamespace(first=lambda: self.row)
+
+
+def test_concurrent_expired_token_lookups_refresh_once(state, monkeypatch):
+    qb._token_cache.clear()
+    posts, saved = [], []
+
+    async def post_token(payload):
+        posts.append(payload)
+        await asyncio.sleep(0.01)
+        return qb.TokenResponse(access_token="new-token", refresh_token="new-refresh")
+
+    async def persist(realm_id, values):
+        saved.append((realm_id, values))
+
+    monkeypatch.setattr(qb, "_post_token", post_token)
+    monkeypatch.setattr(qb, "_persist_refreshed_token", persist)
+
+    async def run():
+        tokens = await asyncio.gather(
+            *(
+                qb.QuickBooksService(FakeDb())._get_access_token(REALM_ID)
+                for _ in range(5)
+            )
+        )
+        await qb.flush_pending_writes()
+        return tokens
+
+    tokens = asyncio.run(run())
+
+    assert tokens == ["new-token"] * 5
+    assert posts == [{"grant_type": "refresh_token", "refresh_token": "refresh-token"}]
+    assert [values["refresh_token"] for _, values in saved] == ["new-refresh"]
+
+
+def test_get_with_retry_retries_throttling_and_server_errors(session, sleeps):
+    session.responses.extend(
+        [
+            FakeResponse(429, headers={"Retry-After": "2"}),
+            FakeResponse(503),
+            FakeResponse(200, b"ok", headers={"ETag": '"v1"'}),
+        ]
+    )
+
+    status, body, etag = asyncio.run(qb._get_with_retry("https://qbo/report"))
+
+    assert (status, body, etag) == (200, b"ok", '"v1"')
+    assert len(session.requests) == 3
+    assert sleeps[0] == 2.0
+    assert len(sleeps) == 2
+
+
+def test_get_with_retry_caps_retry_after(session, sleeps):
+    session.responses.extend(
+        [FakeResponse(429, headers={"Retry-After": "120"}), FakeResponse(200)]
+    )
+
+    asyncio.run(qb._get_with_retry("https://qbo/report"))
+
+    assert sleeps == [qb._BACKOFF_MAX]
+
+
+def test_get_with_retry_returns_last_error_status(session, sleeps):
+    session.responses.extend(FakeResponse(500) for _ in range(qb._MAX_ATTEMPTS))
+
+    status, _, _ = asyncio.run(qb._get_with_retry("https://qbo/report"))
+
+    assert status == 500
+    assert len(session.requests) == qb._MAX_ATTEMPTS
+    assert len(sleeps) == qb._MAX_ATTEMPTS - 1
+
+
+def test_get_with_retry_wraps_network_errors(session, sleeps):
+    session.responses.extend(
+        aiohttp.ClientConnectionError("reset") for _ in range(qb._MAX_ATTEMPTS)
+    )
+
+    with pytest.raises(qb.QBApiError):
+        asyncio.run(qb._get_with_retry("https://qbo/report"))
+
+    assert len(session.requests) == qb._MAX_ATTEMPTS